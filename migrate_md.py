@@ -1,14 +1,71 @@
 #!/bin/env python3
 
+import fnmatch
+import os
 import pathlib
+import re
 import sys
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# read and write files by chunks of 1 MiB rather than the default 8 KiB
+_BUFFER_SIZE = 1 << 20
+
+# number of lines written at once to the migrated file
+_WRITE_BATCH_SIZE = 4096
+
+# ioctl request cloning a file on Linux (see linux/fs.h), exposed by fcntl since Python 3.12
+_FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
 
 HELP = """Usage: migrate_md.py pattern
 
 pattern: pattern relative to the current directory, ending with ".md" (eg. *.md, foo.md)
 """
 
+# line opening and closing the header of a Jekyll file
+_HEADER_DELIMITER = "---\n"
+
+# single scan of each line for all the Jekyll markers handled by the processors below (except HeaderTransformer),
+# lines without any of them can not be modified by the processors
+_MARKERS = re.compile(
+    r"\{% highlight"
+    r"|\{% endhighlight %\}"
+    r"|\{:toc\}|\* Table of Contents"
+    r"|post_url"
+    r"|site\.url"
+)
+# link to another page: "({% post_url path %}" (the closing parenthesis may be preceded by an anchor)
+_POST_URL_RE = re.compile(r"\(\s*\{%\s*post_url\s+(.+?)\s*%\}")
+# link to a static resource: "({{ site.url }}path)"
+_SITE_URL_RE = re.compile(r"\(\s*\{\{\s*site\.url\s*\}\}\s*([^)]*?)\s*\)")
+
+
+def _customize_post_url_path(link_path: str) -> str:
+    for known_relative_path in ["articles/", "tips/"]:
+        if link_path.startswith(known_relative_path):
+            return "/" + link_path + ".md"
+    return link_path
+
+
+def _replace_post_url(m: re.Match) -> str:
+    return "({filename}" + _customize_post_url_path(m.group(1))
+
+
+def _customize_site_url_path(link_path: str) -> str:
+    resources_prefix = "/resources/"
+    if link_path.startswith(resources_prefix):
+        return "/images/" + link_path[len(resources_prefix):]
+    return link_path
+
+
+def _replace_site_url(m: re.Match) -> str:
+    return "({static}" + _customize_site_url_path(m.group(1)) + ")"
+
 
 class LineProcessor:
     def process_line(self, line_number: int, line: str) -> (bool, str | None):
@@ -28,6 +85,9 @@ class HeaderTransformer(LineProcessor):
     """This LineProcessor will process all lines of the header.
     The header is defined by `---\n` on line 0 until the next line with `---\n`
     """
+    # tags used by _new_header_content(), items of other tags are not kept
+    _known_tags = {"title", "tags", "description"}
+
     def __init__(self):
         self.primed: bool = False
         self.completed: bool = False
@@ -44,27 +104,30 @@ class HeaderTransformer(LineProcessor):
             self.content[self.current_tag] = value
 
     def _process_item(self, item: str):
-        # remove extra spaces but most importantly, remove new line char
-        item = item.strip()
         if not self.current_tag:
             raise RuntimeError("item found while there is no current tag")
+        if isinstance(self.content.get(self.current_tag), str):
+            raise RuntimeError(f"item found but tag {self.current_tag} already has a value")
+        if self.current_tag not in self._known_tags:
+            return
+        # remove extra spaces but most importantly, remove new line char
+        item = item.strip()
         if self.current_tag in self.content:
-            if isinstance(self.content[self.current_tag], str):
-                raise RuntimeError(f"item found but tag {self.current_tag} already has a value")
             self.content[self.current_tag].append(item)
         else:
             self.content[self.current_tag] = [item]
 
     def _new_header_content(self) -> list[str]:
         res = []
-        for k, v in self.content.items():
-            match k:
-                case "title":
-                    res.append("Title: " + v.strip('"'))
-                case "tags":
-                    res.append("Tags: " + ", ".join(v))
-                case "description":
-                    res.append("Summary: " + v)
+        title = self.content.get("title")
+        if title:
+            res.append("Title: " + title.strip('"'))
+        tags = self.content.get("tags")
+        if tags:
+            res.append("Tags: " + ", ".join(tags))
+        description = self.content.get("description")
+        if description:
+            res.append("Summary: " + description)
 
         return res
 
@@ -74,32 +137,34 @@ class HeaderTransformer(LineProcessor):
                  (True, new_header_content) where new_header_content are the lines of the new header
                  otherwise (False, line)
         """
-        if line_number == 0 and line == "---\n":
+        if line_number == 0 and line == _HEADER_DELIMITER:
             self.primed = True
             return True, None
 
         if not self.primed or self.completed:
             return False, line
 
-        try:
-            colon_index = line.index(":")
-            if colon_index > 1:
-                self._process_tag(line[:colon_index], line[colon_index+1:])
-            return True, None
-        except ValueError:
-            pass
-
-        if line.lstrip().startswith("- "):
-            self._process_item(line[line.index("-")+1:].strip())
-            return True, None
-
-        if line == "---\n":
+        if line == _HEADER_DELIMITER:
             self.completed = True
             new_lines = self._new_header_content()
             if new_lines:
                 return True, "\n".join(new_lines) + "\n"
             return True, None
 
+        colon_index = line.find(":")
+        if colon_index > -1:
+            if colon_index > 1:
+                self._process_tag(line[:colon_index], line[colon_index+1:])
+            return True, None
+
+        # YAML list items, only lines starting with a space can need stripping
+        if line.startswith(("- ", " ", "\t")):
+            stripped = line.lstrip()
+            if stripped.startswith("- "):
+                # _process_item() strips the item
+                self._process_item(stripped[2:])
+                return True, None
+
         return False, line
 
 
@@ -108,20 +173,31 @@ class CodeBlocks(LineProcessor):
     Use Pelican compatible syntax for opening and close code blocks
     Replace the whole line as long as Jenkins opening or closing patterns are found in the line
     """
+    # both opening and closing patterns start with it
+    _probe = "{%"
     _opening_start = "{% highlight"
+    _opening_start_length = len(_opening_start)
     _opening_end = "%}"
+    _closing_line = "```\n"
+    # Pelican opening lines by language, a site only uses a few languages
+    _opening_lines: dict[str, str] = {}
 
     def process_line(self, line_number: int, line: str) -> (bool, str | None):
-        try:
-            s = line.index(self._opening_start)
-            e = line.index(self._opening_end, s + len(self._opening_start))
-            language = line[s+len(self._opening_start):e].strip()
-            return True, f"```{language}\n"
-        except ValueError:
-            pass
+        if self._probe not in line:
+            return False, line
+
+        s = line.find(self._opening_start)
+        if s > -1:
+            e = line.find(self._opening_end, s + self._opening_start_length)
+            if e > -1:
+                language = line[s+self._opening_start_length:e].strip()
+                opening_line = self._opening_lines.get(language)
+                if opening_line is None:
+                    opening_line = self._opening_lines[language] = f"```{language}\n"
+                return True, opening_line
 
         if "{% endhighlight %}" in line:
-            return True, "```\n"
+            return True, self._closing_line
 
         return False, line
 
@@ -130,11 +206,13 @@ class Toc(LineProcessor):
     """Replace Jekyll syntax for Table of Content by Pelican one.
     Remove line containing "* Table of Contents" and replace line containing "{:toc}" by "[TOC]\n"
     """
+    _toc_line = "[TOC]\n"
+
     def process_line(self, line_number: int, line: str) -> (bool, str | None):
         if "* Table of Contents" in line:
             return True, None
         if "{:toc}" in line:
-            return True, "[TOC]\n"
+            return True, self._toc_line
 
         return False, line
 
@@ -142,86 +220,36 @@ class Toc(LineProcessor):
 class InternalContentLinks(LineProcessor):
     """Replace Jekyll syntax for links to other pages by the Pelican one.
     Search for parenthesis in the line containing "{% post_url %}" (support missing or additional blank spaces around
-    "post_url") and replace it by "{filename}"
+    "post_url") and replace it by "{filename}".
+    All links of the line are replaced in a single pass.
     """
     _post_url_tag = "post_url"
 
-    @staticmethod
-    def _customize_link_path(link_path: str) -> str:
-        for known_relative_path in ["articles/", "tips/"]:
-            if link_path.startswith(known_relative_path):
-                return "/" + link_path + ".md"
-        return link_path
-
     def process_line(self, line_number: int, line: str) -> (bool, str | None):
-        new_line = line
-        pos = new_line.find(self._post_url_tag)
-        if pos < 0:
+        if self._post_url_tag not in line:
             return False, line
 
-        try:
-            while pos > -1:
-                op = new_line.index("(", pos - 5, pos)
-                ep = new_line.index(")")
-                link_path = new_line[op+1:ep].strip()
-                pp = link_path.find("{%")
-                pe = link_path.find("%}")
-                if pp > -1 and pe > -1:
-                    link_path = link_path[pp+2:pe].strip()
-                    if not link_path.startswith(self._post_url_tag):
-                        raise RuntimeError(f"Can not find post_url in {link_path}")
-                    link_path = link_path[len(self._post_url_tag) + 1:].strip()
-                    link_path = self._customize_link_path(link_path)
-                    new_line = new_line[0:op+pp+1] + "{filename}" + link_path + new_line[op+pe+3:]
-                else:
-                    raise RuntimeError(f"Can not find markers in {link_path}")
-                pos = new_line.find(self._post_url_tag)
-        except ValueError as e:
-            raise RuntimeError("Failed to find parenthesis within range") from e
-
+        new_line, count = _POST_URL_RE.subn(_replace_post_url, line)
+        if not count:
+            raise RuntimeError(f"Can not find markers in {line}")
         return True, new_line
 
 
 class SiteLinks(LineProcessor):
     """Replace Jekyll syntax for links to static resources the Pelican one.
     Search for parenthesis in the line containing "{{ site.url }}" (support missing or additional blank spaces around
-    "site.url") and replace it by "{static}"
+    "site.url") and replace it by "{static}".
+    All links of the line are replaced in a single pass.
     """
     _site_url_tag = "site.url"
 
-    @staticmethod
-    def _customize_link_path(link_path: str) -> str:
-        resources_prefix = "/resources/"
-        if link_path.startswith(resources_prefix):
-            return "/images/" + link_path[len(resources_prefix):]
-        return link_path
-
     def process_line(self, line_number: int, line: str) -> (bool, str | None):
-        new_line = line
-        pos = new_line.find(self._site_url_tag)
-        if pos < 0:
+        if self._site_url_tag not in line:
             return False, line
 
-        try:
-            while pos > -1:
-                op = new_line.index("(", pos - 5, pos)
-                ep = new_line.index(")")
-                link_path = new_line[op+1:ep].strip()
-                pp = link_path.find("{{")
-                pe = link_path.find("}}")
-                if pp > -1 and pe > -1:
-                    site_url = link_path[pp+2:pe].strip()
-                    if site_url != self._site_url_tag:
-                        raise RuntimeError(f"Can not find tag in {link_path}")
-                    link_path = link_path[pe+2:].strip()
-                    link_path = self._customize_link_path(link_path)
-                    new_line = new_line[0:op + pp + 1] + "{static}" + link_path + new_line[ep:]
-                else:
-                    raise RuntimeError(f"Can not find markers in {link_path}")
-                pos = new_line.find(self._site_url_tag)
-        except ValueError as e:
-            raise RuntimeError("Failed to find parenthesis within range") from e
-
+        new_line, count = _SITE_URL_RE.subn(_replace_site_url, line)
+        if not count:
+            raise RuntimeError(f"Can not find markers in {line}")
         return True, new_line
 
 
@@ -235,31 +263,131 @@ def _create_processors():
     ]
 
 
+def _create_transformer(has_header: bool = True):
+    """
+    :param has_header: False if the file does not start with a header, in which case HeaderTransformer is not used
+    :return: a function taking the number and the content of a line and returning the text to write instead of the
+             line (the line itself if no processor modified it), `None` to remove it.
+             The function applies the processors returned by _create_processors() as described by migrate() and,
+             as HeaderTransformer is stateful, a new one must be created for each file.
+    """
+    processors = _create_processors()
+    header = processors[0]
+    if not has_header:
+        processors = processors[1:]
+    # resolve methods once rather than for each line
+    search = _MARKERS.search
+    process_header = header.process_line
+    process_lines = [p.process_line for p in processors]
+
+    def transform_line(line_number: int, line: str) -> str | None:
+        if has_header and (line_number == 0 or (header.primed and not header.completed)):
+            modified, new_line = process_header(line_number, line)
+            if modified:
+                return new_line
+
+        # no marker, no processor will modify the line
+        if search(line) is None:
+            return line
+
+        for process_line in process_lines:
+            modified, new_line = process_line(line_number, line)
+            # stops at 1st processor modifying the line
+            if modified:
+                return new_line
+        # if no processor modified the line, keep it
+        return line
+
+    return transform_line
+
+
+def _fast_copy(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """copy src to dst as `shutil.copy` does but, on Linux, share data blocks with src when the filesystem supports it
+    (reflink on Btrfs, XFS, ...) or copy data within the kernel, to avoid moving the content through userspace
+    """
+    if sys.platform == "linux":
+        with src.open('rb') as f_src, dst.open('wb') as f_dst:
+            src_fd, dst_fd = f_src.fileno(), f_dst.fileno()
+            try:
+                fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+                copied = True
+            except OSError:
+                copied = False
+            if not copied:
+                try:
+                    remaining = os.fstat(src_fd).st_size
+                    while remaining > 0:
+                        count = os.copy_file_range(src_fd, dst_fd, remaining)
+                        # some filesystems return 0 without copying anything
+                        if count == 0:
+                            break
+                        remaining -= count
+                    # a partial backup would be used as the source of the migration, copy it again in full
+                    copied = remaining == 0
+                except OSError:
+                    pass
+        if copied:
+            shutil.copymode(src, dst)
+            return
+
+    shutil.copy(src, dst)
+
+
+def _has_header(md_file: pathlib.Path) -> bool:
+    """:return: whether the first line of the file is the header delimiter, whatever its line return character(s)"""
+    with md_file.open('rb') as f:
+        return f.read(len(_HEADER_DELIMITER) + 1).startswith((b"---\n", b"---\r"))
+
+
 def migrate(md_file):
     """create a backup file (if it does not exist yet) and overwrite file by reading backup file line by line
     and writing the same line if no processor changed it, otherwise writing content provided by the 1st
     processor returned by _create_processors() that declared processing the line (see LineProcessor.process_line())
+
+    Once out of the header, lines without any marker matched by _MARKERS are written as is without calling the
+    processors.
     """
     print(f"Migrating {md_file}...")
 
     backup_file = md_file.parent / f"{md_file.stem}.md.backup"
     if not backup_file.exists():
-        shutil.copy(md_file, backup_file)
-
-    processors = _create_processors()
-    with backup_file.open('r') as f_backup, md_file.open('w') as f_md:
+        _fast_copy(md_file, backup_file)
+
+    transform_line = _create_transformer(_has_header(backup_file))
+    with backup_file.open('r', buffering=_BUFFER_SIZE) as f_backup, \
+            md_file.open('w', buffering=_BUFFER_SIZE) as f_md:
+        lines = []
+        append = lines.append
+        writelines = f_md.writelines
         for n, l in enumerate(f_backup):
-            modified = False
-            for p in processors:
-                modified, new_line = p.process_line(n, l)
-                # stops at 1st processor modifying the line
-                if modified:
-                    if new_line:
-                        f_md.write(new_line)
-                    break
-            # if no processor modified the line, keep it
-            if not modified:
-                f_md.write(l)
+            new_line = transform_line(n, l)
+            if new_line:
+                append(new_line)
+                if len(lines) >= _WRITE_BATCH_SIZE:
+                    writelines(lines)
+                    lines.clear()
+        writelines(lines)
+
+
+def _find_files(pattern: str):
+    """:return: the files matching the pattern (directories are ignored), as pathlib's glob() would.
+                Patterns for files of a single directory (eg. *.md, posts/*.md) are resolved with os.scandir() which
+                does not create a Path nor stat each entry of the directory.
+    """
+    directory, name_pattern = os.path.split(pattern)
+    if any(c in directory for c in "*?["):
+        yield from (path for path in pathlib.Path().glob(pattern) if path.is_file())
+        return
+    try:
+        it = os.scandir(directory or ".")
+    except (FileNotFoundError, NotADirectoryError):
+        # like pathlib's glob(), nothing matches in a missing directory
+        return
+    with it:
+        for entry in it:
+            # like pathlib's glob(), match hidden files too and ignore case on Windows only (fnmatch() normalizes case)
+            if fnmatch.fnmatch(entry.name, name_pattern) and entry.is_file():
+                yield pathlib.Path(entry.path)
 
 
 def main():
@@ -272,8 +400,10 @@ def main():
         print(HELP)
         exit(1)
 
-    for f in pathlib.Path().glob(pattern):
-        migrate(f)
+    # files are independent from each other, migrate them in parallel
+    with ProcessPoolExecutor() as executor:
+        # consume results to raise the first error, if any
+        list(executor.map(migrate, _find_files(pattern), chunksize=4))
 
 
 if __name__ == "__main__":
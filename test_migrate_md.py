@@ -0,0 +1,248 @@
+import contextlib
+import io
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import migrate_md
+
+
+def _migrate(content: str) -> str:
+    """migrate a file with the provided content and return the migrated content"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_file = pathlib.Path(tmp_dir) / "post.md"
+        md_file.write_text(content)
+        with contextlib.redirect_stdout(io.StringIO()):
+            migrate_md.migrate(md_file)
+        return md_file.read_text()
+
+
+class HeaderTransformerTest(unittest.TestCase):
+    def _process(self, *lines: str) -> list[tuple[bool, str | None]]:
+        processor = migrate_md.HeaderTransformer()
+        return [processor.process_line(n, line) for n, line in enumerate(lines)]
+
+    def test_tags_with_items(self):
+        self.assertEqual(
+            (True, "Tags: python, jekyll, pelican\n"),
+            self._process("---\n", "tags:\n", "  - python\n", "- jekyll\n", "    -   pelican  \n", "---\n")[-1])
+
+    def test_tab_indented_items(self):
+        self.assertEqual(
+            (True, "Tags: python, jekyll\n"),
+            self._process("---\n", "tags:\n", "\t- python\n", "\t- jekyll\n", "---\n")[-1])
+
+    def test_unknown_tag_with_items(self):
+        self.assertEqual(
+            [(True, None)] * 7 + [(True, "Tags: python\n")],
+            self._process(
+                "---\n", "categories:\n", "  - misc\n", "  - notes\n", "tags:\n", "  - python\n", "layout: post\n",
+                "---\n"))
+
+    def test_items_of_tag_with_value(self):
+        with self.assertRaisesRegex(RuntimeError, "tag categories already has a value"):
+            self._process("---\n", "categories: foo\n", "  - bar\n")
+        with self.assertRaisesRegex(RuntimeError, "tag tags already has a value"):
+            self._process("---\n", "tags: foo\n", "  - bar\n")
+
+    def test_item_without_tag(self):
+        with self.assertRaisesRegex(RuntimeError, "no current tag"):
+            self._process("---\n", "  - bar\n")
+
+    def test_header_content_order(self):
+        self.assertEqual(
+            (True, "Title: Hello: world\nTags: python\nSummary: A post\n"),
+            self._process(
+                "---\n", "description: A post\n", "tags:\n", "  - python\n", "Title: \"Hello: world\"\n",
+                "---\n")[-1])
+
+    def test_no_header(self):
+        self.assertEqual([(False, "text\n"), (False, "---\n")], self._process("text\n", "---\n"))
+
+
+class InternalContentLinksTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = migrate_md.InternalContentLinks()
+
+    def test_line_without_link(self):
+        self.assertEqual((False, "some text\n"), self.processor.process_line(1, "some text\n"))
+
+    def test_articles_link(self):
+        self.assertEqual(
+            (True, "[a]({filename}/articles/2020-01-01-foo.md)\n"),
+            self.processor.process_line(1, "[a]({% post_url articles/2020-01-01-foo %})\n"))
+
+    def test_tips_link(self):
+        self.assertEqual(
+            (True, "[a]({filename}/tips/bar.md)\n"),
+            self.processor.process_line(1, "[a]({%post_url tips/bar%})\n"))
+
+    def test_other_link(self):
+        self.assertEqual(
+            (True, "[a]({filename}2020-01-01-foo)\n"),
+            self.processor.process_line(1, "[a]({%  post_url  2020-01-01-foo  %})\n"))
+
+    def test_url_encoded_link(self):
+        self.assertEqual(
+            (True, "[a]({filename}foo%20bar)\n"),
+            self.processor.process_line(1, "[a]({% post_url foo%20bar %})\n"))
+
+    def test_link_with_anchor(self):
+        self.assertEqual(
+            (True, "[a]({filename}/articles/foo.md#section)\n"),
+            self.processor.process_line(1, "[a]({% post_url articles/foo %}#section)\n"))
+
+    def test_several_links(self):
+        self.assertEqual(
+            (True, "(see) [a]({filename}/articles/foo.md) and [b]({filename}/tips/bar.md#section).\n"),
+            self.processor.process_line(
+                1, "(see) [a]({% post_url articles/foo %}) and [b]({% post_url tips/bar %}#section).\n"))
+
+    def test_bare_mention(self):
+        with self.assertRaises(RuntimeError):
+            self.processor.process_line(1, "the post_url tag\n")
+
+
+class SiteLinksTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = migrate_md.SiteLinks()
+
+    def test_line_without_link(self):
+        self.assertEqual((False, "some text\n"), self.processor.process_line(1, "some text\n"))
+
+    def test_resources_link(self):
+        self.assertEqual(
+            (True, "![i]({static}/images/a.png)\n"),
+            self.processor.process_line(1, "![i]({{ site.url }}/resources/a.png)\n"))
+
+    def test_other_link(self):
+        self.assertEqual(
+            (True, "![i]({static}/files/a.pdf)\n"),
+            self.processor.process_line(1, "![i]({{site.url}}/files/a.pdf)\n"))
+
+    def test_several_links(self):
+        self.assertEqual(
+            (True, "(see) ![i]({static}/images/a.png) and ![j]({static}/files/b.png)\n"),
+            self.processor.process_line(
+                1, "(see) ![i]({{ site.url }}/resources/a.png) and ![j]({{ site.url }}/files/b.png)\n"))
+
+    def test_bare_mention(self):
+        with self.assertRaises(RuntimeError):
+            self.processor.process_line(1, "the site.url variable\n")
+
+
+class FastCopyTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.src = pathlib.Path(tmp_dir.name) / "post.md"
+        self.src.write_text("some content\n" * 1000)
+        self.dst = pathlib.Path(tmp_dir.name) / "post.md.backup"
+
+    def test_copy(self):
+        migrate_md._fast_copy(self.src, self.dst)
+        self.assertEqual(self.src.read_bytes(), self.dst.read_bytes())
+
+    @unittest.skipUnless(hasattr(migrate_md.os, "copy_file_range"), "os.copy_file_range() not available")
+    def test_copy_file_range_copying_nothing(self):
+        with mock.patch.object(migrate_md.fcntl, "ioctl", side_effect=OSError), \
+                mock.patch.object(migrate_md.os, "copy_file_range", return_value=0):
+            migrate_md._fast_copy(self.src, self.dst)
+        self.assertEqual(self.src.read_bytes(), self.dst.read_bytes())
+
+
+class FindFilesTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        # patterns are relative to the current directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp_dir.name)
+        for name in [".hidden.md", "a.md", "b.txt", "posts/c.md", "dir.md/d.md"]:
+            pathlib.Path(name).parent.mkdir(exist_ok=True)
+            pathlib.Path(name).touch()
+
+    def _assert_files(self, expected: list[str], pattern: str):
+        self.assertEqual(sorted(pathlib.Path(p) for p in expected), sorted(migrate_md._find_files(pattern)))
+
+    def test_files_of_directory(self):
+        # hidden files are matched and directories are ignored
+        self._assert_files([".hidden.md", "a.md"], "*.md")
+
+    def test_files_of_subdirectory(self):
+        self._assert_files(["posts/c.md"], "posts/*.md")
+
+    def test_recursive_pattern(self):
+        # directories are ignored
+        self._assert_files([".hidden.md", "a.md", "posts/c.md", "dir.md/d.md"], "**/*.md")
+
+    def test_missing_directory(self):
+        self.assertEqual([], list(migrate_md._find_files("nope/*.md")))
+
+
+class MigrateTest(unittest.TestCase):
+    def test_header(self):
+        self.assertEqual(
+            "Title: Hello\n"
+            "\n"
+            "text\n"
+            "---\n",
+            _migrate(
+                "---\n"
+                "layout: post\n"
+                "title: \"Hello\"\n"
+                "---\n"
+                "\n"
+                "text\n"
+                "---\n"))
+
+    def test_header_with_crlf_line_endings(self):
+        self.assertEqual(
+            "Title: Hello\n"
+            "text\n",
+            _migrate(
+                "---\r\n"
+                "title: Hello\r\n"
+                "---\r\n"
+                "text\r\n"))
+
+    def test_header_delimiter_not_on_first_line(self):
+        content = (
+            "text\n"
+            "---\n"
+            "title: Hello\n"
+            "---\n"
+        )
+        self.assertEqual(content, _migrate(content))
+
+    def test_links(self):
+        self.assertEqual(
+            "text\n"
+            "[a]({filename}/articles/foo.md#section) and [b]({filename}bar)\n"
+            "![i]({static}/images/a.png)\n",
+            _migrate(
+                "text\n"
+                "[a]({% post_url articles/foo %}#section) and [b]({% post_url bar %})\n"
+                "![i]({{ site.url }}/resources/a.png)\n"))
+
+    def test_processors_order_prevails_over_markers_position(self):
+        self.assertEqual(
+            "```python\n",
+            _migrate("mention post_url then {% highlight python %}\n"))
+        # only the 1st processor modifying the line is applied
+        self.assertEqual(
+            "![i]({{ site.url }}/resources/a.png) and [p]({filename}/articles/x.md)\n",
+            _migrate("![i]({{ site.url }}/resources/a.png) and [p]({% post_url articles/x %})\n"))
+
+    def test_line_without_marker(self):
+        self.assertEqual("some {% raw %} text\n", _migrate("some {% raw %} text\n"))
+
+    def test_bare_post_url_mention(self):
+        with self.assertRaises(RuntimeError):
+            _migrate("the post_url tag\n")
+
+
+if __name__ == "__main__":
+    unittest.main()